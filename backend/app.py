@@ -1,35 +1,40 @@
 from __future__ import annotations
 
+import asyncio
 import os
+import threading
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Iterator, Tuple
 
 import orjson
 from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from backend.config import settings
+from backend.config import get_settings
 from backend.models.chat import ChatRequest, ChatResponse
 from backend.services.data_manager import data_manager
 from backend.services.query_engine import query_engine
+from backend.utils.executors import run_io, shutdown_executors
 from backend.utils.logger import logger
 
 
-def orjson_dumps(v: Any, *, default: Any | None = None) -> str:
-    return orjson.dumps(v, default=default).decode()
+settings = get_settings()
 
 
-try:
-    from dotenv import load_dotenv
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson (handles numpy scalars natively)."""
 
-    load_dotenv()
-except Exception:
-    pass
+    media_type = "application/json"
 
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
 
-app = FastAPI(default_response_class=JSONResponse)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +45,33 @@ app.add_middleware(
 )
 
 
+async def _janitor() -> None:
+    """Periodically drop expired sessions outside of the request path."""
+    interval = max(1, settings.session_ttl_minutes * 10)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_io(data_manager.maybe_cleanup)
+        except Exception:  # noqa: BLE001
+            logger.exception("Session cleanup failed")
+
+
+_janitor_task: asyncio.Task | None = None
+
+
+@app.on_event("startup")
+async def _start_janitor() -> None:
+    global _janitor_task
+    _janitor_task = asyncio.create_task(_janitor())
+
+
+@app.on_event("shutdown")
+async def _shutdown_executors() -> None:
+    if _janitor_task is not None:
+        _janitor_task.cancel()
+    shutdown_executors()
+
+
 @app.get("/api/healthz")
 async def healthz() -> Dict[str, str]:
     return {"status": "ok"}
@@ -71,15 +103,64 @@ async def chat(req: ChatRequest) -> ChatResponse:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest) -> StreamingResponse:
+    """Server-sent events: `token` events carry LLM deltas, `final` carries the ChatResponse."""
+    try:
+        events = query_engine.answer_stream(req.session_id, req.message)
+    except KeyError as ke:
+        raise HTTPException(status_code=404, detail=str(ke)) from ke
+    return StreamingResponse(_sse(events), media_type="text/event-stream")
+
+
+_STREAM_END = object()
+
+
+async def _sse(events: Iterator[Tuple[str, Any]]) -> AsyncIterator[bytes]:
+    # Pull each item on the IO pool: the iterator blocks on the LLM and DuckDB.
+    # The lock makes close() wait for a next() still running in its thread.
+    lock = threading.Lock()
+
+    def pull() -> Any:
+        with lock:
+            return next(events, _STREAM_END)
+
+    def close() -> None:
+        with lock:
+            events.close()
+
+    try:
+        while True:
+            try:
+                item = await run_io(pull)
+            except Exception as exc:  # noqa: BLE001
+                logger.exception("Chat stream failed")
+                yield _sse_event("error", {"detail": str(exc)})
+                return
+            if item is _STREAM_END:
+                return
+            event, payload = item
+            if event == "final":
+                payload = ChatResponse(**payload).model_dump(mode="json")
+            yield _sse_event(event, payload)
+    finally:
+        # On client disconnect, release the upstream LLM stream now rather than
+        # at garbage collection; shielded so the close still runs when cancelled
+        await asyncio.shield(run_io(close))
+
+
+def _sse_event(event: str, data: Any) -> bytes:
+    body = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY, default=str)
+    return b"event: " + event.encode() + b"\ndata: " + body + b"\n\n"
+
+
 async def _answer_chat(req: ChatRequest) -> Dict[str, Any]:
     # Offload heavy steps if needed; current operations are lightweight
     return await _to_thread(query_engine.answer, req.session_id, req.message)
 
 
 async def _to_thread(func, *args, **kwargs):  # type: ignore[no-untyped-def]
-    import asyncio
-
-    return await asyncio.to_thread(func, *args, **kwargs)
+    return await run_io(func, *args, **kwargs)
 
 
 # Serve frontend
@@ -1,36 +1,61 @@
 import os
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import List
 
-try:
-    from dotenv import load_dotenv
 
-    load_dotenv()
-except Exception:
-    # .env is optional
-    pass
+def _load_dotenv() -> None:
+    # Env marker guards against re-parsing .env on repeat imports in the same process tree
+    if os.getenv("_DOTENV_LOADED") == "1":
+        return
+    try:
+        from dotenv import load_dotenv
 
+        load_dotenv()
+    except Exception:
+        # .env is optional
+        pass
+    os.environ["_DOTENV_LOADED"] = "1"
 
-def _default_cors_origins() -> List[str]:
-    value = os.getenv("CORS_ORIGINS")
-    return value.split(",") if value else ["*"]
 
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
 
-@dataclass
+
+@dataclass(frozen=True)
 class Settings:
     """Runtime configuration loaded from environment variables."""
 
-    openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
-    openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    cors_origins: List[str] = field(default_factory=_default_cors_origins)
-    max_file_size_mb: int = int(os.getenv("MAX_FILE_SIZE_MB", "25"))
-    max_rows: int = int(os.getenv("MAX_ROWS", "100000"))
-    preview_rows: int = int(os.getenv("PREVIEW_ROWS", "20"))
-    sample_rows_for_llm: int = int(os.getenv("SAMPLE_ROWS_FOR_LLM", "10"))
-    enable_sql_output: bool = bool(int(os.getenv("ENABLE_SQL_OUTPUT", "1")))
-    session_ttl_minutes: int = int(os.getenv("SESSION_TTL_MINUTES", "60"))
-
-
-settings = Settings()
-
-
+    openai_api_key: str = ""
+    openai_model: str = "gpt-4o-mini"
+    cors_origins: List[str] = field(default_factory=lambda: ["*"])
+    max_file_size_mb: int = 25
+    max_rows: int = 100000
+    preview_rows: int = 20
+    sample_rows_for_llm: int = 10
+    enable_sql_output: bool = True
+    session_ttl_minutes: int = 60
+    duckdb_threads: int = 0  # 0 = DuckDB default
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        cors_origins = os.getenv("CORS_ORIGINS")
+        return cls(
+            openai_api_key=os.getenv("OPENAI_API_KEY", ""),
+            openai_model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            cors_origins=cors_origins.split(",") if cors_origins else ["*"],
+            max_file_size_mb=_env_int("MAX_FILE_SIZE_MB", 25),
+            max_rows=_env_int("MAX_ROWS", 100000),
+            preview_rows=_env_int("PREVIEW_ROWS", 20),
+            sample_rows_for_llm=_env_int("SAMPLE_ROWS_FOR_LLM", 10),
+            enable_sql_output=bool(_env_int("ENABLE_SQL_OUTPUT", 1)),
+            session_ttl_minutes=_env_int("SESSION_TTL_MINUTES", 60),
+            duckdb_threads=_env_int("DUCKDB_THREADS", 0),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Parse the environment once, on first use, and share the frozen result."""
+    _load_dotenv()
+    return Settings.from_env()
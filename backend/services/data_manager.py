@@ -1,56 +1,162 @@
 from __future__ import annotations
 
-import asyncio
+import os
+import secrets
+import tempfile
 import time
-import uuid
 from dataclasses import dataclass, field
-from threading import RLock
-from typing import Dict, Optional
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import duckdb
 import pandas as pd
 from fastapi import UploadFile
 
-from backend.config import settings
-from backend.utils.dataframe_utils import infer_schema, preview_dataframe, read_dataframe_from_bytes
+from backend.config import get_settings
+from backend.utils.dataframe_utils import (
+    dataframe_to_records,
+    infer_schema,
+    optimize_dtypes,
+    read_dataframe_from_bytes,
+    read_dataframe_from_path,
+    summarize_dataframe,
+)
+from backend.services.llm_client import llm_client
+from backend.utils.executors import run_cpu
 from backend.utils.logger import logger
 
 
+settings = get_settings()
+
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB per read
+UPLOAD_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # larger uploads spill to a temp file
+
+
 @dataclass
 class DataSession:
+    """An uploaded table and the DuckDB cursor it is queried through.
+
+    Sessions are immutable after upload. run_sql registers `dataframe` by
+    reference as the view `table_name` on a child cursor of `duckdb_conn`
+    for each query, so DuckDB scans it without copying.
+    """
+
     session_id: str
     duckdb_conn: duckdb.DuckDBPyConnection
     table_name: str
     dataframe: pd.DataFrame
+    # Derived from `dataframe` and reused by every chat request; filled at
+    # upload (or lazily by the cached_* accessors)
+    schema: List[Dict[str, Any]] = field(default_factory=list)
+    sample_rows: List[Dict[str, Any]] = field(default_factory=list)
+    prompt_prefix: str = ""
+    # Proposal-cache key for `prompt_prefix`, set together with it; read it
+    # through cached_prompt_fingerprint()
+    prompt_fingerprint: str = ""
     created_at: float = field(default_factory=lambda: time.time())
     last_used_at: float = field(default_factory=lambda: time.time())
 
     def touch(self) -> None:
         self.last_used_at = time.time()
 
+    def cached_schema(self) -> List[Dict[str, Any]]:
+        if not self.schema:
+            self.schema = infer_schema(self.dataframe)
+        return self.schema
+
+    def cached_sample(self) -> List[Dict[str, Any]]:
+        if not self.sample_rows:
+            self.sample_rows = dataframe_to_records(
+                self.dataframe.head(settings.sample_rows_for_llm)
+            )
+        return self.sample_rows
+
+    def cached_prompt_prefix(self) -> str:
+        if not self.prompt_prefix:
+            prefix = llm_client.build_prompt_prefix(
+                self.cached_schema(), self.cached_sample(), self.table_name
+            )
+            # Assigned left to right: the fingerprint is in place before a
+            # concurrent reader can see a non-empty prefix
+            self.prompt_fingerprint, self.prompt_prefix = (
+                llm_client.prompt_fingerprint(prefix),
+                prefix,
+            )
+        return self.prompt_prefix
+
+    def cached_prompt_fingerprint(self) -> str:
+        self.cached_prompt_prefix()
+        return self.prompt_fingerprint
+
 
 class DataManager:
     """In-memory session store for uploaded data and attached DuckDB connections."""
 
     def __init__(self) -> None:
         self._sessions: Dict[str, DataSession] = {}
-        self._lock = RLock()
+        # Guards writers only; dict reads are atomic under the GIL
+        self._lock = Lock()
+        self._expiry_callbacks: List[Callable[[str], None]] = []
+        # One shared in-memory database; each session gets its own cursor so
+        # registered views stay isolated while the buffer pool and worker
+        # threads are shared across sessions.
+        self._db = duckdb.connect(":memory:")
+        if settings.duckdb_threads > 0:
+            self._db.execute(f"SET threads={int(settings.duckdb_threads)}")
 
     def _make_session_id(self) -> str:
-        return uuid.uuid4().hex
+        return secrets.token_hex(16)
+
+    async def _receive_upload(self, file: UploadFile) -> Union[bytes, str]:
+        """Stream the upload in chunks, rejecting oversized files early.
+
+        Small files come back as bytes. Larger ones are spilled to a named temp
+        file whose path is returned, so the parser process reads it from disk
+        instead of receiving a pickled copy; the caller removes the file.
+        """
+        limit = settings.max_file_size_mb * 1024 * 1024
+        total = 0
+        buffer = bytearray()
+        spill = None
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > limit:
+                    raise ValueError(
+                        f"File too large: > {settings.max_file_size_mb}MB"
+                    )
+                if spill is None and len(buffer) + len(chunk) > UPLOAD_SPOOL_MAX_SIZE:
+                    spill = tempfile.NamedTemporaryFile(prefix="datawiz-", delete=False)
+                    spill.write(buffer)
+                    buffer = bytearray()
+                if spill is None:
+                    buffer += chunk
+                else:
+                    spill.write(chunk)
+        except BaseException:
+            if spill is not None:
+                spill.close()
+                os.unlink(spill.name)
+            raise
+        if spill is None:
+            return bytes(buffer)
+        spill.close()
+        return spill.name
 
     async def create_session_from_upload(self, file: UploadFile) -> Dict:
-        file_bytes = await file.read()
-        size_mb = len(file_bytes) / (1024 * 1024)
-        if size_mb > settings.max_file_size_mb:
-            raise ValueError(
-                f"File too large: {size_mb:.1f}MB > {settings.max_file_size_mb}MB"
-            )
-
-        # Heavy IO/CPU in thread
-        df: pd.DataFrame = await asyncio.to_thread(
-            read_dataframe_from_bytes, file_bytes, file.filename
-        )
+        source = await self._receive_upload(file)
+
+        # Parsing is CPU-bound: run it in the process pool to avoid the GIL
+        if isinstance(source, str):
+            try:
+                df: pd.DataFrame = await run_cpu(
+                    read_dataframe_from_path, source, file.filename
+                )
+            finally:
+                os.unlink(source)
+        else:
+            df = await run_cpu(read_dataframe_from_bytes, source, file.filename)
 
         if df.empty:
             raise ValueError("Uploaded table has no rows")
@@ -63,28 +169,29 @@ class DataManager:
             )
             df = df.head(settings.max_rows).copy()
 
-        # Create session + attach DataFrame to DuckDB
+        df = optimize_dtypes(df)
+
+        # Create session with its own cursor; run_sql exposes the DataFrame
+        # to DuckDB as a zero-copy view per query
         session_id = self._make_session_id()
-        conn = duckdb.connect()
+        conn = self._db.cursor()
         table_name = "data"
-        conn.register("df_view", df)
-        conn.execute(
-            f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM df_view"
-        )
+
+        schema, preview = summarize_dataframe(df, settings.preview_rows)
 
         session = DataSession(
             session_id=session_id,
             duckdb_conn=conn,
             table_name=table_name,
             dataframe=df,
+            schema=schema,
         )
+        # Sample rows and the LLM prompt are built once, up front
+        session.cached_prompt_prefix()
 
         with self._lock:
             self._sessions[session_id] = session
 
-        schema = infer_schema(df)
-        preview = preview_dataframe(df, settings.preview_rows)
-
         return {
             "session_id": session_id,
             "schema": schema,
@@ -92,13 +199,16 @@ class DataManager:
         }
 
     def get_session(self, session_id: str) -> DataSession:
-        with self._lock:
-            session = self._sessions.get(session_id)
+        session = self._sessions.get(session_id)
         if not session:
             raise KeyError("Session not found or expired")
         session.touch()
         return session
 
+    def add_expiry_callback(self, callback: Callable[[str], None]) -> None:
+        """Register a hook called with each session_id dropped by cleanup."""
+        self._expiry_callbacks.append(callback)
+
     def maybe_cleanup(self) -> None:
         ttl_seconds = settings.session_ttl_minutes * 60
         now = time.time()
@@ -113,6 +223,12 @@ class DataManager:
                 except Exception:  # noqa: BLE001
                     pass
                 del self._sessions[sid]
+        for sid in to_delete:
+            for callback in self._expiry_callbacks:
+                try:
+                    callback(sid)
+                except Exception:  # noqa: BLE001
+                    logger.exception("Session expiry callback failed")
         if to_delete:
             logger.info("Cleaned up %d expired sessions", len(to_delete))
 
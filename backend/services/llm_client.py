@@ -1,13 +1,54 @@
 from __future__ import annotations
 
-import json
+import hashlib
 import re
-from typing import Any, Dict, List
+from collections import OrderedDict
+from functools import cached_property
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from backend.config import settings
+import orjson
+
+from backend.config import get_settings
 from backend.utils.logger import logger
 
 
+settings = get_settings()
+
+
+_FENCE_HEAD = re.compile(r"^```(json)?", re.IGNORECASE)
+_FENCE_TAIL = re.compile(r"```$")
+_JSON_BLOCK = re.compile(r"\{[\s\S]*\}")
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+
+_SQL_CACHE_SIZE = 1024
+
+# Stable system prompt; the per-session schema and sample are appended once at
+# upload so every chat request shares an identical, cacheable prompt prefix.
+_SYSTEM_INSTRUCTIONS = (
+    "You are a senior data analyst translating natural language questions into DuckDB SQL "
+    "over a single table named \"{table_name}\". "
+    "Rules: use only the provided columns; quote identifiers with double quotes; use DuckDB syntax. "
+    "Return STRICT JSON with keys: sql (string, only SELECT or WITH), explanation (short), answer_hint (short, optional). "
+    "If the question cannot be answered with the columns, set sql to an empty string and explain why. "
+    "Respond with JSON only, no markdown fences. Example: {{\"sql\": \"SELECT ...\", \"explanation\": \"...\"}}."
+)
+
+_REPAIR_TEMPLATE = (
+    "Question: {question}\n\n"
+    "Previous SQL:\n{previous_sql}\n\n"
+    "Execution error: {error_message}\n\n"
+    "Produce a corrected SQL query if possible, as STRICT JSON with keys: sql, explanation, answer_hint (optional). "
+    "If not fixable, set sql to an empty string."
+)
+
+
+def _dumps(value: Any) -> str:
+    """Serialize to a JSON string; unknown scalars (e.g. Timestamps) fall back to str()."""
+    return orjson.dumps(value, option=_JSON_OPTIONS, default=str).decode()
+
+
 class LLMClient:
     """LLM wrapper for text-to-SQL planning. Uses LangChain when available."""
 
@@ -25,51 +66,58 @@ class LLMClient:
                 logger.error("Failed to initialize OpenAI client: %s", exc)
                 self._client = None
 
-        # Try to prepare a LangChain pipeline
-        self._lc_chain = None
-        if self._client is not None:
-            try:
-                from langchain_openai import ChatOpenAI  # type: ignore
-                from langchain.prompts import ChatPromptTemplate  # type: ignore
-                from langchain_core.output_parsers import (  # type: ignore
-                    JsonOutputParser,
-                )
+        # LRU of proposals keyed by (prompt prefix fingerprint, normalized question)
+        self._sql_cache: OrderedDict[Tuple[str, str], Dict[str, Any]] = OrderedDict()
+        self._sql_cache_lock = Lock()
 
-                self._lc_llm = ChatOpenAI(
-                    model=settings.openai_model,
-                    temperature=0.1,
-                    api_key=settings.openai_api_key,
-                )
+    @cached_property
+    def _lc_llm(self) -> Any:
+        """LangChain chat model, built on first use so idle workers skip the import cost."""
+        if self._client is None:
+            return None
+        try:
+            from langchain_openai import ChatOpenAI  # type: ignore
 
-                # Few high-signal instructions with strict JSON output
-                system_instructions = (
-                    "You are a senior data analyst translating questions to DuckDB SQL over a single table named \"data\". "
-                    "Rules: Use only provided columns; quote identifiers with double quotes; use DuckDB syntax; "
-                    "return STRICT JSON with keys: sql (string, only SELECT or WITH), explanation (short), answer_hint (short, optional). "
-                    "If not answerable, set sql to empty string and explain why."
-                )
+            return ChatOpenAI(
+                model=settings.openai_model,
+                temperature=0.1,
+                api_key=settings.openai_api_key,
+            )
+        except Exception as exc:  # noqa: BLE001
+            # LangChain is optional; fallback to raw OpenAI client
+            logger.info("LangChain unavailable, falling back to raw OpenAI: %s", exc)
+            return None
 
-                human_template = (
-                    "Table schema (name, pandas dtype, kind):\n{schema_text}\n\n"
-                    "Small data sample (JSON rows):\n{sample_text}\n\n"
-                    "Question: {question}\n\n"
-                    "Respond with JSON only, no markdown fences."
-                )
+    def _build_lc_chain(self, human_template: str) -> Any:
+        if self._lc_llm is None:
+            return None
+        try:
+            from langchain.prompts import ChatPromptTemplate  # type: ignore
+            from langchain_core.output_parsers import (  # type: ignore
+                JsonOutputParser,
+            )
 
-                prompt = ChatPromptTemplate.from_messages(
-                    [
-                        ("system", system_instructions),
-                        ("human", human_template),
-                    ]
-                )
+            # The pre-rendered prefix is passed as a variable, never re-templated
+            prompt = ChatPromptTemplate.from_messages(
+                [
+                    ("system", "{prompt_prefix}"),
+                    ("human", human_template),
+                ]
+            )
+            parser = JsonOutputParser()
+            # LCEL chain: prompt -> model -> JSON parser
+            return prompt | self._lc_llm | parser
+        except Exception as exc:  # noqa: BLE001
+            logger.info("LangChain unavailable, falling back to raw OpenAI: %s", exc)
+            return None
 
-                parser = JsonOutputParser()
-                # LCEL chain: prompt -> model -> JSON parser
-                self._lc_chain = prompt | self._lc_llm | parser
-            except Exception as exc:  # noqa: BLE001
-                # LangChain is optional; fallback to raw OpenAI client
-                logger.info("LangChain unavailable, falling back to raw OpenAI: %s", exc)
-                self._lc_chain = None
+    @cached_property
+    def _lc_chain(self) -> Any:
+        return self._build_lc_chain("{question}")
+
+    @cached_property
+    def _lc_repair_chain(self) -> Any:
+        return self._build_lc_chain(_REPAIR_TEMPLATE)
 
     def is_available(self) -> bool:
         return self._client is not None
@@ -77,16 +125,16 @@ class LLMClient:
     def _extract_json(self, text: str) -> Dict[str, Any]:
         """Extract the first JSON object from a string; fallback to empty dict."""
         cleaned = text.strip()
-        cleaned = re.sub(r"^```(json)?", "", cleaned, flags=re.IGNORECASE).strip()
-        cleaned = re.sub(r"```$", "", cleaned).strip()
+        cleaned = _FENCE_HEAD.sub("", cleaned).strip()
+        cleaned = _FENCE_TAIL.sub("", cleaned).strip()
         try:
-            return json.loads(cleaned)
+            return orjson.loads(cleaned)
         except Exception:  # noqa: BLE001
             pass
-        match = re.search(r"\{[\s\S]*\}", cleaned)
+        match = _JSON_BLOCK.search(cleaned)
         if match:
             try:
-                return json.loads(match.group(0))
+                return orjson.loads(match.group(0))
             except Exception:  # noqa: BLE001
                 return {}
         return {}
@@ -96,82 +144,168 @@ class LLMClient:
             [f"- \"{col['name']}\" ({col['pandas_dtype']}, {col['kind']})" for col in schema]
         )
 
-    def propose_sql(self, question: str, schema: List[Dict[str, Any]], sample_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def build_prompt_prefix(
+        self,
+        schema: List[Dict[str, Any]],
+        sample_rows: List[Dict[str, Any]],
+        table_name: str = "data",
+    ) -> str:
+        """Render the system prompt for a dataset; computed once per session at upload."""
+        schema_text = self._format_schema(schema)
+        sample_text = _dumps(sample_rows[: settings.sample_rows_for_llm])
+        return (
+            f"{_SYSTEM_INSTRUCTIONS.format(table_name=table_name)}\n\n"
+            f"Table schema (name, pandas dtype, kind):\n{schema_text}\n\n"
+            f"Small data sample (JSON rows):\n{sample_text}"
+        )
+
+    def prompt_fingerprint(self, prompt_prefix: str) -> str:
+        """Short digest identifying a prompt prefix in the proposal cache; store it per session."""
+        return hashlib.blake2b(prompt_prefix.encode(), digest_size=16).hexdigest()
+
+    def _cache_key(self, prompt_fingerprint: str, question: str) -> Tuple[str, str]:
+        if not prompt_fingerprint:
+            # An empty key would share proposals across datasets
+            raise ValueError("prompt_fingerprint must not be empty")
+        return prompt_fingerprint, " ".join(question.split())
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        with self._sql_cache_lock:
+            cached = self._sql_cache.get(key)
+            if cached is None:
+                return None
+            self._sql_cache.move_to_end(key)
+            return dict(cached)
+
+    def _cache_put(self, key: Tuple[str, str], proposal: Dict[str, Any]) -> None:
+        # Only cache usable answers so transient LLM failures are retried
+        if not proposal.get("sql"):
+            return
+        with self._sql_cache_lock:
+            self._sql_cache[key] = dict(proposal)
+            if len(self._sql_cache) > _SQL_CACHE_SIZE:
+                self._sql_cache.popitem(last=False)
+
+    def _messages(self, prompt_prefix: str, user_prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": prompt_prefix},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def _proposal_from_content(self, content: str) -> Dict[str, Any]:
+        parsed = self._extract_json(content)
+        if not isinstance(parsed, dict):
+            parsed = {}
+        return {
+            "sql": (parsed.get("sql") or "").strip(),
+            "explanation": (parsed.get("explanation") or "").strip(),
+            "answer_hint": (parsed.get("answer_hint") or "").strip(),
+            "raw": content,
+        }
+
+    def _proposal_from_parsed(self, parsed: Any) -> Dict[str, Any]:
+        if not isinstance(parsed, dict):
+            parsed = {}
+        return {
+            "sql": (parsed.get("sql") or "").strip(),
+            "explanation": (parsed.get("explanation") or "").strip(),
+            "answer_hint": (parsed.get("answer_hint") or "").strip(),
+            "raw": _dumps(parsed),
+        }
+
+    def _failed_proposal(self) -> Dict[str, Any]:
+        return {
+            "sql": "",
+            "explanation": "LLM call failed",
+            "answer_hint": "I could not derive a valid SQL for this question.",
+            "raw": "{}",
+        }
+
+    def propose_sql(
+        self, question: str, prompt_prefix: str, prompt_fingerprint: str
+    ) -> Dict[str, Any]:
         if not self._client:
             raise RuntimeError("LLM is not available. Set OPENAI_API_KEY in environment.")
 
-        schema_text = self._format_schema(schema)
-        sample_text = json.dumps(sample_rows[: settings.sample_rows_for_llm], ensure_ascii=False)
+        key = self._cache_key(prompt_fingerprint, question)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
 
+        proposal = self._propose_sql(question, prompt_prefix)
+        self._cache_put(key, proposal)
+        return proposal
+
+    def propose_sql_stream(
+        self, question: str, prompt_prefix: str, prompt_fingerprint: str
+    ) -> Iterator[Tuple[str, Any]]:
+        """Stream a SQL proposal from the raw OpenAI client.
+
+        Yields ("delta", text) for each completion chunk, then a single
+        ("proposal", dict) shaped like the return value of propose_sql.
+        """
+        if not self._client:
+            raise RuntimeError("LLM is not available. Set OPENAI_API_KEY in environment.")
+
+        key = self._cache_key(prompt_fingerprint, question)
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield "proposal", cached
+            return
+
+        parts: List[str] = []
+        try:
+            stream = self._client.chat.completions.create(
+                model=settings.openai_model,
+                messages=self._messages(prompt_prefix, question),
+                temperature=0.1,
+                stream=True,
+            )
+            try:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield "delta", delta
+            finally:
+                # Release the HTTP response even if the consumer stops early
+                stream.close()
+            proposal = self._proposal_from_content("".join(parts) or "{}")
+        except Exception as exc:  # noqa: BLE001
+            logger.error("LLM streaming call failed: %s", exc)
+            proposal = self._failed_proposal()
+
+        self._cache_put(key, proposal)
+        yield "proposal", proposal
+
+    def _propose_sql(self, question: str, prompt_prefix: str) -> Dict[str, Any]:
         # Preferred path: LangChain pipeline with strict JSON parsing
         if self._lc_chain is not None:
             try:
                 parsed = self._lc_chain.invoke(
-                    {
-                        "schema_text": schema_text,
-                        "sample_text": sample_text,
-                        "question": question,
-                    }
+                    {"prompt_prefix": prompt_prefix, "question": question}
                 )
-                if not isinstance(parsed, dict):
-                    parsed = {}
-                return {
-                    "sql": (parsed.get("sql") or "").strip(),
-                    "explanation": (parsed.get("explanation") or "").strip(),
-                    "answer_hint": (parsed.get("answer_hint") or "").strip(),
-                    "raw": json.dumps(parsed, ensure_ascii=False),
-                }
+                return self._proposal_from_parsed(parsed)
             except Exception as exc:  # noqa: BLE001
                 logger.info("LangChain parsing failed, retrying with raw OpenAI: %s", exc)
 
         # Fallback: raw OpenAI Chat Completions
         try:
-            system_prompt = (
-                "You are a senior data analyst helping translate natural language questions into DuckDB SQL. "
-                "You work with a single table named `data`. "
-                "Only use the provided columns. Quote identifiers with double quotes. Use DuckDB syntax. "
-                "Return a strict JSON object with keys: sql (string, SELECT/CTE only), explanation (short string), answer_hint (optional short string). "
-                "If the question cannot be answered with the columns, set sql to an empty string and explain why."
-            )
-            user_prompt = (
-                f"Table schema (name, pandas dtype, kind):\n{schema_text}\n\n"
-                f"Small data sample (JSON rows):\n{sample_text}\n\n"
-                f"Question: {question}\n\n"
-                "Respond with JSON only, no markdown fences. Example: {\"sql\": \"SELECT ...\", \"explanation\": \"...\"}."
-            )
-
             completion = self._client.chat.completions.create(
                 model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
+                messages=self._messages(prompt_prefix, question),
                 temperature=0.1,
             )
             content = completion.choices[0].message.content or "{}"
-            parsed = self._extract_json(content)
-            if not isinstance(parsed, dict):
-                parsed = {}
-            return {
-                "sql": (parsed.get("sql") or "").strip(),
-                "explanation": (parsed.get("explanation") or "").strip(),
-                "answer_hint": (parsed.get("answer_hint") or "").strip(),
-                "raw": content,
-            }
+            return self._proposal_from_content(content)
         except Exception as exc:  # noqa: BLE001
             logger.error("LLM call failed: %s", exc)
-            return {
-                "sql": "",
-                "explanation": "LLM call failed",
-                "answer_hint": "I could not derive a valid SQL for this question.",
-                "raw": "{}",
-            }
+            return self._failed_proposal()
 
     def repair_sql(
         self,
         question: str,
-        schema: List[Dict[str, Any]],
-        sample_rows: List[Dict[str, Any]],
+        prompt_prefix: str,
         previous_sql: str,
         error_message: str,
     ) -> Dict[str, Any]:
@@ -179,91 +313,29 @@ class LLMClient:
         if not self._client:
             raise RuntimeError("LLM is not available. Set OPENAI_API_KEY in environment.")
 
-        schema_text = self._format_schema(schema)
-        sample_text = json.dumps(sample_rows[: settings.sample_rows_for_llm], ensure_ascii=False)
+        variables = {
+            "question": question,
+            "previous_sql": previous_sql,
+            "error_message": error_message,
+        }
 
         # Try LangChain structured repair
-        if self._lc_chain is not None:
+        if self._lc_repair_chain is not None:
             try:
-                from langchain_openai import ChatOpenAI  # type: ignore
-                from langchain.prompts import ChatPromptTemplate  # type: ignore
-                from langchain_core.output_parsers import JsonOutputParser  # type: ignore
-
-                llm = getattr(self, "_lc_llm", None) or ChatOpenAI(
-                    model=settings.openai_model,
-                    temperature=0.1,
-                    api_key=settings.openai_api_key,
-                )
-                system_instructions = (
-                    "You are a DuckDB SQL expert. Given a question, schema, sample rows, a previous SQL and an error, "
-                    "produce a corrected SQL query if possible. Use only the provided columns, quote identifiers with double quotes, "
-                    "and return STRICT JSON with keys: sql, explanation, answer_hint (optional). If not fixable, set sql to empty string."
-                )
-                human_template = (
-                    "Table schema (name, pandas dtype, kind):\n{schema_text}\n\n"
-                    "Sample rows (JSON):\n{sample_text}\n\n"
-                    "Question: {question}\n\n"
-                    "Previous SQL:\n{previous_sql}\n\n"
-                    "Execution error: {error_message}\n\n"
-                    "Respond with JSON only."
-                )
-                prompt = ChatPromptTemplate.from_messages(
-                    [("system", system_instructions), ("human", human_template)]
-                )
-                parser = JsonOutputParser()
-                parsed = (prompt | llm | parser).invoke(
-                    {
-                        "schema_text": schema_text,
-                        "sample_text": sample_text,
-                        "question": question,
-                        "previous_sql": previous_sql,
-                        "error_message": error_message,
-                    }
-                )
-                if not isinstance(parsed, dict):
-                    parsed = {}
-                return {
-                    "sql": (parsed.get("sql") or "").strip(),
-                    "explanation": (parsed.get("explanation") or "").strip(),
-                    "answer_hint": (parsed.get("answer_hint") or "").strip(),
-                    "raw": json.dumps(parsed, ensure_ascii=False),
-                }
+                parsed = self._lc_repair_chain.invoke({"prompt_prefix": prompt_prefix, **variables})
+                return self._proposal_from_parsed(parsed)
             except Exception as exc:  # noqa: BLE001
                 logger.info("LangChain repair failed, retrying with raw OpenAI: %s", exc)
 
         # Fallback to raw OpenAI
         try:
-            system_prompt = (
-                "You are a DuckDB SQL expert. Given a question, schema, sample rows, a previous SQL and an error, "
-                "produce a corrected SQL query if possible. Use only the provided columns, quote identifiers with double quotes. "
-                "Return JSON: {sql, explanation, answer_hint?}. If not fixable, set sql to empty string."
-            )
-            user_prompt = (
-                f"Table schema (name, pandas dtype, kind):\n{schema_text}\n\n"
-                f"Sample rows (JSON):\n{sample_text}\n\n"
-                f"Question: {question}\n\n"
-                f"Previous SQL:\n{previous_sql}\n\n"
-                f"Execution error: {error_message}\n\n"
-                "Respond with JSON only."
-            )
             completion = self._client.chat.completions.create(
                 model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
+                messages=self._messages(prompt_prefix, _REPAIR_TEMPLATE.format(**variables)),
                 temperature=0.1,
             )
             content = completion.choices[0].message.content or "{}"
-            parsed = self._extract_json(content)
-            if not isinstance(parsed, dict):
-                parsed = {}
-            return {
-                "sql": (parsed.get("sql") or "").strip(),
-                "explanation": (parsed.get("explanation") or "").strip(),
-                "answer_hint": (parsed.get("answer_hint") or "").strip(),
-                "raw": content,
-            }
+            return self._proposal_from_content(content)
         except Exception as exc:  # noqa: BLE001
             logger.error("LLM repair call failed: %s", exc)
             return {
@@ -275,5 +347,3 @@ class LLMClient:
 
 
 llm_client = LLMClient()
-
-
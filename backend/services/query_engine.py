@@ -1,36 +1,112 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional, Tuple
 
-from backend.config import settings
+import pyarrow as pa
+
+from backend.config import get_settings
 from backend.services.data_manager import DataSession, data_manager
 from backend.services.llm_client import llm_client
-from backend.services.sql_runner import run_sql
-from backend.utils.dataframe_utils import preview_dataframe
+from backend.services.sql_runner import is_deterministic, run_sql
+from backend.utils.dataframe_utils import arrow_column_to_pylist, preview_arrow_table
+
+
+settings = get_settings()
+
+
+_RESULT_CACHE_SIZE = 256
+_RESULT_PREVIEW_ROWS = 20
 
 
 class QueryEngine:
+    def __init__(self) -> None:
+        # Sessions are immutable after upload, so (session_id, sql) fully
+        # determines the result of deterministic SQL (queries using now(),
+        # random() etc. are never cached); entries are dropped when a session
+        # expires.
+        self._result_cache: OrderedDict[Tuple[str, str], Tuple[pa.Table, Dict[str, Any]]] = OrderedDict()
+        self._result_cache_lock = Lock()
+        data_manager.add_expiry_callback(self._drop_session_results)
+
+    def _drop_session_results(self, session_id: str) -> None:
+        with self._result_cache_lock:
+            for key in [k for k in self._result_cache if k[0] == session_id]:
+                del self._result_cache[key]
+
+    def _run_sql_cached(
+        self, session: DataSession, sql: str
+    ) -> Tuple[Optional[pa.Table], Dict[str, Any]]:
+        if not is_deterministic(sql):
+            return run_sql(session, sql, limit=_RESULT_PREVIEW_ROWS)
+
+        key = (session.session_id, sql.strip().strip(";"))
+        with self._result_cache_lock:
+            hit = self._result_cache.get(key)
+            if hit is not None:
+                self._result_cache.move_to_end(key)
+                return hit
+
+        # Only the preview head is kept, so cached results stay small
+        table, meta = run_sql(session, sql, limit=_RESULT_PREVIEW_ROWS)
+        if table is not None:
+            with self._result_cache_lock:
+                self._result_cache[key] = (table, meta)
+                if len(self._result_cache) > _RESULT_CACHE_SIZE:
+                    self._result_cache.popitem(last=False)
+        return table, meta
+
     def answer(self, session_id: str, question: str) -> Dict[str, Any]:
         session: DataSession = data_manager.get_session(session_id)
-        data_manager.maybe_cleanup()
-
-        schema = [
-            {"name": c, "pandas_dtype": str(session.dataframe[c].dtype), "kind": ""}
-            for c in session.dataframe.columns
-        ]
-        sample = session.dataframe.head(settings.sample_rows_for_llm).to_dict(
-            orient="records"
+
+        if not llm_client.is_available():
+            return self._llm_unavailable()
+
+        proposal = llm_client.propose_sql(
+            question=question,
+            prompt_prefix=session.cached_prompt_prefix(),
+            prompt_fingerprint=session.cached_prompt_fingerprint(),
         )
+        return self._answer_from_proposal(session, question, proposal)
+
+    def answer_stream(self, session_id: str, question: str) -> Iterator[Tuple[str, Any]]:
+        """Like answer(), but yields ("token", text) LLM deltas before ("final", result).
+
+        The session is resolved eagerly so an unknown id raises KeyError here
+        rather than mid-stream.
+        """
+        session: DataSession = data_manager.get_session(session_id)
+        return self._answer_stream(session, question)
 
+    def _answer_stream(self, session: DataSession, question: str) -> Iterator[Tuple[str, Any]]:
         if not llm_client.is_available():
-            return {
-                "answer": "LLM is not configured. Set OPENAI_API_KEY to enable natural language querying.",
-                "sql": None,
-                "result_preview": None,
-                "explanation": None,
-            }
+            yield "final", self._llm_unavailable()
+            return
+
+        proposal: Dict[str, Any] = {}
+        for event, payload in llm_client.propose_sql_stream(
+            question=question,
+            prompt_prefix=session.cached_prompt_prefix(),
+            prompt_fingerprint=session.cached_prompt_fingerprint(),
+        ):
+            if event == "delta":
+                yield "token", payload
+            else:
+                proposal = payload
+        yield "final", self._answer_from_proposal(session, question, proposal)
+
+    def _llm_unavailable(self) -> Dict[str, Any]:
+        return {
+            "answer": "LLM is not configured. Set OPENAI_API_KEY to enable natural language querying.",
+            "sql": None,
+            "result_preview": None,
+            "explanation": None,
+        }
 
-        proposal = llm_client.propose_sql(question=question, schema=schema, sample_rows=sample)
+    def _answer_from_proposal(
+        self, session: DataSession, question: str, proposal: Dict[str, Any]
+    ) -> Dict[str, Any]:
         sql = proposal.get("sql") or ""
         explanation = proposal.get("explanation") or None
 
@@ -42,15 +118,14 @@ class QueryEngine:
                 "explanation": explanation,
             }
 
-        df, meta = run_sql(session, sql)
-        if df is None:
+        table, meta = self._run_sql_cached(session, sql)
+        if table is None:
             # Attempt one repair via LLM using the error message
             error_message = meta.get("error", "SQL execution failed")
             try:
                 repair = llm_client.repair_sql(
                     question=question,
-                    schema=schema,
-                    sample_rows=sample,
+                    prompt_prefix=session.cached_prompt_prefix(),
                     previous_sql=sql,
                     error_message=error_message,
                 )
@@ -59,20 +134,15 @@ class QueryEngine:
 
             repaired_sql = (repair.get("sql") or "").strip()
             if repaired_sql:
-                df2, meta2 = run_sql(session, repaired_sql)
-                if df2 is not None:
+                table2, meta2 = self._run_sql_cached(session, repaired_sql)
+                if table2 is not None:
                     explanation_text = repair.get("explanation") or explanation
-                    # Build a small textual answer if the result is a single value
-                    if df2.shape == (1, 1):
-                        answer_text = f"{df2.columns[0]} = {df2.iloc[0, 0]}"
-                    else:
-                        answer_text = (
-                            f"Query returned {meta2.get('row_count')} rows and {len(meta2.get('columns', []))} columns."
-                        )
                     return {
-                        "answer": answer_text,
+                        "answer": self._answer_text(table2, meta2),
                         "sql": repaired_sql if settings.enable_sql_output else None,
-                        "result_preview": preview_dataframe(df2, rows=min(20, len(df2))),
+                        "result_preview": preview_arrow_table(
+                            table2, rows=_RESULT_PREVIEW_ROWS, row_count=meta2["row_count"]
+                        ),
                         "explanation": explanation_text,
                     }
 
@@ -84,22 +154,22 @@ class QueryEngine:
                 "explanation": explanation,
             }
 
-        # Build a small textual answer if the result is a single value
-        answer_text: str
-        if df.shape == (1, 1):
-            answer_text = f"{df.columns[0]} = {df.iloc[0, 0]}"
-        else:
-            answer_text = (
-                f"Query returned {meta.get('row_count')} rows and {len(meta.get('columns', []))} columns."
-            )
-
         return {
-            "answer": answer_text,
+            "answer": self._answer_text(table, meta),
             "sql": sql if settings.enable_sql_output else None,
-            "result_preview": preview_dataframe(df, rows=min(20, len(df))),
+            "result_preview": preview_arrow_table(
+                table, rows=_RESULT_PREVIEW_ROWS, row_count=meta["row_count"]
+            ),
             "explanation": explanation,
         }
 
+    def _answer_text(self, table: pa.Table, meta: Dict[str, Any]) -> str:
+        # Build a small textual answer if the result is a single value
+        if meta.get("row_count") == 1 and table.num_columns == 1:
+            value = arrow_column_to_pylist(table.column(0).slice(0, 1))[0]
+            return f"{table.schema.names[0]} = {value}"
+        return f"Query returned {meta.get('row_count')} rows and {len(meta.get('columns', []))} columns."
+
 
 query_engine = QueryEngine()
 
@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 import re
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-import pandas as pd
+import pyarrow as pa
 
 from backend.services.data_manager import DataSession
 
 
+_BATCH_ROWS = 65536
+
 FORBIDDEN_TOKENS = {
     "drop",
     "insert",
@@ -23,32 +25,85 @@ FORBIDDEN_TOKENS = {
     "system",
 }
 
+# Functions whose result depends on when/where the query runs
+VOLATILE_TOKENS = {
+    "now",
+    "today",
+    "current_date",
+    "current_time",
+    "current_timestamp",
+    "get_current_time",
+    "get_current_timestamp",
+    "transaction_timestamp",
+    "localtime",
+    "localtimestamp",
+    "random",
+    "setseed",
+    "uuid",
+    "gen_random_uuid",
+    "nextval",
+}
+
+
+# Compare whole words so identifiers such as "updated_at" are not rejected
+_WORD_RE = re.compile(r"\w+")
+_FORBIDDEN = frozenset(FORBIDDEN_TOKENS)
+_VOLATILE = frozenset(VOLATILE_TOKENS)
+
 
 def is_safe_select(sql: str) -> bool:
-    text = re.sub(r"\s+", " ", sql).strip().strip(";")
-    lowered = text.lower()
-    if not (lowered.startswith("select ") or lowered.startswith("with ")):
+    lowered = sql.lower()
+    # split() skips leading whitespace of any kind, so no normalization pass
+    tokens = lowered.split(maxsplit=1)
+    if len(tokens) < 2 or tokens[0] not in ("select", "with"):
         return False
-    if any(tok in lowered for tok in FORBIDDEN_TOKENS):
-        return False
-    return True
+    return _FORBIDDEN.isdisjoint(_WORD_RE.findall(lowered))
+
+
+def is_deterministic(sql: str) -> bool:
+    """False if the query calls a time/random function, so its result must not be cached."""
+    return _VOLATILE.isdisjoint(_WORD_RE.findall(sql.lower()))
 
 
-def run_sql(session: DataSession, sql: str) -> Tuple[pd.DataFrame | None, Dict[str, Any]]:
+def run_sql(
+    session: DataSession, sql: str, limit: Optional[int] = None
+) -> Tuple[pa.Table | None, Dict[str, Any]]:
     """Execute a SELECT/CTE query against the session's DuckDB table.
 
-    Returns (df, meta) where meta may contain an 'error' message.
+    Returns (table, meta) where table is a pyarrow.Table (no pandas
+    materialization) and meta may contain an 'error' message. With `limit`,
+    only the first `limit` rows are kept; the rest are streamed batch by
+    batch just to count them, so meta["row_count"] is still the full count.
     """
     sql_clean = sql.strip().strip(";")
     if not is_safe_select(sql_clean):
         return None, {"error": "Only SELECT/WITH queries are allowed."}
+    # A DuckDB connection is not safe for concurrent use, so each query runs on
+    # its own child cursor. Registered views are connection-local, hence the
+    # (zero-copy) re-registration of the session DataFrame.
+    cursor = session.duckdb_conn.cursor()
     try:
-        df = session.duckdb_conn.execute(sql_clean).df()
-        return df, {
-            "row_count": int(len(df)),
-            "columns": list(df.columns),
+        cursor.register(session.table_name, session.dataframe)
+        reader = cursor.execute(sql_clean).fetch_record_batch(_BATCH_ROWS)
+        if limit is None:
+            table = reader.read_all()
+            row_count = table.num_rows
+        else:
+            kept: List[pa.RecordBatch] = []
+            kept_rows = 0
+            row_count = 0
+            for batch in reader:
+                row_count += batch.num_rows
+                if kept_rows < limit:
+                    head = batch.slice(0, limit - kept_rows)
+                    kept.append(head)
+                    kept_rows += head.num_rows
+            table = pa.Table.from_batches(kept, schema=reader.schema)
+        return table, {
+            "row_count": row_count,
+            "columns": table.schema.names,
         }
     except Exception as exc:  # noqa: BLE001
         return None, {"error": f"SQL execution failed: {exc}"}
-
-
+    finally:
+        cursor.close()
@@ -1,18 +1,80 @@
 from __future__ import annotations
 
+import codecs
 import io
-from typing import Any, Dict, List, Tuple
+from datetime import timedelta
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
 from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
 
 
-def try_read_csv(file_bytes: bytes) -> pd.DataFrame:
-    """Try reading CSV with common encodings. Raise last exception if all fail."""
+BytesSource = Union[bytes, IO[bytes]]
+
+_CARDINALITY_BLOCK = 8192
+_SCHEMA_SAMPLE_SIZE = 5000
+_ENCODING_SNIFF_BYTES = 64 * 1024
+_CSV_FALLBACK_ENCODINGS = ("utf-8", "utf-8-sig", "cp1251", "latin1")
+
+
+def _as_buffer(source: BytesSource) -> IO[bytes]:
+    """Wrap raw bytes in a buffer; pass file-like objects through unchanged."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def detect_encoding(head: bytes) -> str:
+    """Pick the first common encoding that strictly decodes a leading sample."""
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for encoding in _CSV_FALLBACK_ENCODINGS:
+        try:
+            # Incremental decode tolerates a multi-byte char cut at the sample end
+            codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin1"
+
+
+def _read_csv_arrow(buffer: IO[bytes], encoding: str) -> pd.DataFrame:
+    """Parse with Arrow's multithreaded CSV reader into Arrow-backed pandas dtypes."""
+    from pyarrow import csv as pa_csv
+
+    table = pa_csv.read_csv(
+        buffer,
+        read_options=pa_csv.ReadOptions(encoding=encoding),
+        # Match pandas: empty string cells become missing values
+        convert_options=pa_csv.ConvertOptions(strings_can_be_null=True),
+    )
+    names = table.column_names
+    if len(set(names)) != len(names) or not all(names):
+        # pandas dedupes ("a.1") and fills ("Unnamed: 0") headers; Arrow keeps them
+        raise ValueError("Duplicate or empty CSV header names")
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def try_read_csv(source: BytesSource) -> pd.DataFrame:
+    """Read CSV with a sniffed encoding, then fall back to common encodings.
+
+    Raise last exception if all fail.
+    """
+    buffer = _as_buffer(source)
+    detected = detect_encoding(buffer.read(_ENCODING_SNIFF_BYTES))
+    try:
+        buffer.seek(0)
+        return _read_csv_arrow(buffer, detected)
+    except Exception:  # noqa: BLE001
+        # Sample was not representative, pyarrow is unavailable, or the header
+        # has duplicate/empty names that only pandas knows how to rename
+        pass
+
     last_exc: Exception | None = None
-    for encoding in ("utf-8", "utf-8-sig", "cp1251", "latin1"):
+    for encoding in _CSV_FALLBACK_ENCODINGS:
         try:
-            return pd.read_csv(io.BytesIO(file_bytes), encoding=encoding)
+            buffer.seek(0)
+            return pd.read_csv(buffer, encoding=encoding)
         except Exception as exc:  # noqa: BLE001
             last_exc = exc
     if last_exc:
@@ -20,62 +82,211 @@ def try_read_csv(file_bytes: bytes) -> pd.DataFrame:
     raise ValueError("Unable to read CSV with common encodings")
 
 
-def read_dataframe_from_bytes(file_bytes: bytes, filename: str) -> pd.DataFrame:
-    """Load a DataFrame from CSV/XLS/XLSX bytes.
+def read_excel(buffer: IO[bytes]) -> pd.DataFrame:
+    """Read the first sheet with the Rust calamine engine, falling back to pandas' default."""
+    try:
+        return pd.read_excel(buffer, engine="calamine")
+    except Exception:  # noqa: BLE001
+        # python-calamine missing, pandas < 2.2, or a workbook calamine rejects
+        buffer.seek(0)
+        return pd.read_excel(buffer)
+
 
-    - For CSV tries multiple encodings
+def read_dataframe_from_bytes(source: BytesSource, filename: str) -> pd.DataFrame:
+    """Load a DataFrame from CSV/XLS/XLSX bytes or a seekable binary file.
+
+    - For CSV sniffs the encoding, falling back to common encodings
     - For Excel reads the first sheet
     """
+    buffer = _as_buffer(source)
     lower = filename.lower()
     if lower.endswith(".csv"):
-        df = try_read_csv(file_bytes)
+        df = try_read_csv(buffer)
     elif lower.endswith(".xlsx") or lower.endswith(".xls"):
-        df = pd.read_excel(io.BytesIO(file_bytes))
+        df = read_excel(buffer)
     else:
         # Fallback: try CSV, then Excel
         try:
-            df = try_read_csv(file_bytes)
+            df = try_read_csv(buffer)
         except Exception:  # noqa: BLE001
-            df = pd.read_excel(io.BytesIO(file_bytes))
+            buffer.seek(0)
+            df = read_excel(buffer)
 
     # Normalize column names by stripping whitespace
     df.columns = [str(c).strip() for c in df.columns]
     return df
 
 
-def infer_column_kind(series: pd.Series) -> str:
+def read_dataframe_from_path(path: str, filename: str) -> pd.DataFrame:
+    """read_dataframe_from_bytes() for an upload spilled to disk; `filename` picks the format."""
+    with open(path, "rb") as handle:
+        return read_dataframe_from_bytes(handle, filename)
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink the in-memory footprint of an uploaded DataFrame.
+
+    - With pyarrow installed, switch to Arrow-backed dtypes (contiguous strings)
+    - Otherwise cast low-cardinality object columns to ``category``
+    """
+    try:
+        return df.convert_dtypes(dtype_backend="pyarrow")
+    except ImportError:
+        pass
+    n_rows = len(df)
+    if not n_rows:
+        return df
+    for name in df.select_dtypes(include="object").columns:
+        if df[name].nunique() / n_rows < 0.5:
+            df[name] = df[name].astype("category")
+    return df
+
+
+def dataframe_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert rows to a list of dicts, via Arrow's C++ path when pyarrow is available."""
+    try:
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(df, preserve_index=False).to_pylist()
+    except Exception:  # noqa: BLE001
+        # pyarrow missing or mixed-type object columns Arrow cannot represent;
+        # plain tuples skip the per-cell boxing done by to_dict(orient="records")
+        columns = list(df.columns)
+        return [dict(zip(columns, row)) for row in df.itertuples(index=False, name=None)]
+
+
+def dataframe_to_columns(df: pd.DataFrame) -> List[List[Any]]:
+    """Convert to one list of values per column (no per-row dicts)."""
+    try:
+        import pyarrow as pa
+
+        return [column.to_pylist() for column in pa.Table.from_pandas(df, preserve_index=False).columns]
+    except Exception:  # noqa: BLE001
+        # pyarrow missing or mixed-type object columns Arrow cannot represent
+        return [df.iloc[:, i].tolist() for i in range(df.shape[1])]
+
+
+def infer_column_kind(series: pd.Series, sample_size: Optional[int] = None) -> str:
     if is_datetime64_any_dtype(series):
         return "datetime"
     if is_numeric_dtype(series):
         return "numeric"
-    # Treat low-cardinality strings as categorical
-    unique_count = series.dropna().nunique()
-    if unique_count <= max(10, int(0.02 * len(series))):
-        return "categorical"
-    return "text"
+    threshold = max(10, int(0.02 * len(series)))
+    if sample_size is not None and len(series) > sample_size:
+        # Look at the head and tail only. More distinct values than the
+        # threshold is conclusive; a sample that is mostly repeats is taken as
+        # categorical. Small (mostly-null) samples and the ambiguous middle
+        # fall through to the full scan.
+        half = max(1, sample_size // 2)
+        sample = pd.concat([series.iloc[:half], series.iloc[-half:]]).dropna()
+        sample_unique = sample.nunique()
+        if sample_unique > threshold:
+            return "text"
+        if len(sample) > threshold and (
+            sample_unique / len(sample) * len(series) <= threshold
+        ):
+            return "categorical"
+    # Treat low-cardinality strings as categorical. Scan in blocks and stop as
+    # soon as the distinct count passes the threshold instead of hashing the
+    # whole column.
+    seen: set = set()
+    for start in range(0, len(series), _CARDINALITY_BLOCK):
+        block = series.iloc[start : start + _CARDINALITY_BLOCK].dropna()
+        seen.update(block.unique())
+        if len(seen) > threshold:
+            return "text"
+    return "categorical"
 
 
-def infer_schema(df: pd.DataFrame) -> List[Dict[str, Any]]:
-    schema: List[Dict[str, Any]] = []
-    for name in df.columns:
-        kind = infer_column_kind(df[name])
-        schema.append(
-            {
-                "name": name,
-                "pandas_dtype": str(df[name].dtype),
-                "kind": kind,
-            }
-        )
-    return schema
+def _column_schema(name: Any, series: pd.Series, sample_size: Optional[int]) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "pandas_dtype": str(series.dtype),
+        "kind": infer_column_kind(series, sample_size),
+    }
+
+
+def infer_schema(
+    df: pd.DataFrame, sample_size: Optional[int] = _SCHEMA_SAMPLE_SIZE
+) -> List[Dict[str, Any]]:
+    """Describe each column; pass `sample_size=None` for an exact cardinality scan."""
+    return [_column_schema(name, series, sample_size) for name, series in df.items()]
 
 
 def preview_dataframe(df: pd.DataFrame, rows: int) -> Dict[str, Any]:
+    """Columnar preview: `data[i]` holds the first `rows` values of `columns[i]`."""
     sample = df.head(rows)
     return {
         "columns": list(sample.columns),
-        "rows": sample.to_dict(orient="records"),
+        "data": dataframe_to_columns(sample),
         "row_count": int(len(df)),
         "column_count": int(df.shape[1]),
     }
 
 
+def arrow_column_to_pylist(column: Any) -> List[Any]:
+    """to_pylist() for a DuckDB result column, keeping values JSON-friendly.
+
+    - Decimals (e.g. SUM over integers, which is HUGEINT) become int or float
+      instead of Decimal objects that serialize as strings
+    - Intervals become timedelta (months counted as 30 days, as DuckDB's
+      pandas conversion does) instead of MonthDayNano tuples
+    """
+    import pyarrow as pa
+
+    kind = column.type
+    if pa.types.is_decimal(kind):
+        if kind.scale == 0:
+            try:
+                return column.cast(pa.int64()).to_pylist()
+            except pa.ArrowInvalid:
+                # Does not fit in int64
+                pass
+        return column.cast(pa.float64()).to_pylist()
+    if pa.types.is_interval(kind):
+        return [
+            None
+            if value is None
+            else timedelta(
+                days=value.months * 30 + value.days,
+                microseconds=value.nanoseconds / 1000,
+            )
+            for value in column.to_pylist()
+        ]
+    return column.to_pylist()
+
+
+def preview_arrow_table(table: Any, rows: int, row_count: int | None = None) -> Dict[str, Any]:
+    """preview_dataframe() for a pyarrow.Table; only the first `rows` rows are converted.
+
+    Pass `row_count` when `table` is already a truncated head of a larger result.
+    """
+    return {
+        "columns": table.schema.names,
+        "data": [arrow_column_to_pylist(column) for column in table.slice(0, rows).columns],
+        "row_count": int(table.num_rows if row_count is None else row_count),
+        "column_count": int(table.num_columns),
+    }
+
+
+def summarize_dataframe(
+    df: pd.DataFrame, rows: int, sample_size: Optional[int] = _SCHEMA_SAMPLE_SIZE
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Return (infer_schema(df), preview_dataframe(df, rows)) from a single column loop.
+
+    The preview head is sliced and converted once; each column's schema entry
+    and preview values are then produced side by side.
+    """
+    head_columns = dataframe_to_columns(df.head(rows))
+    schema: List[Dict[str, Any]] = []
+    data: List[List[Any]] = []
+    for (name, series), values in zip(df.items(), head_columns):
+        schema.append(_column_schema(name, series, sample_size))
+        data.append(values)
+    preview = {
+        "columns": list(df.columns),
+        "data": data,
+        "row_count": int(len(df)),
+        "column_count": int(df.shape[1]),
+    }
+    return schema, preview
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+# Bounded pools shared by the whole app:
+# - IO_POOL for blocking LLM/DuckDB calls (threads, GIL released while waiting)
+# - CPU_POOL for CPU-bound parsing (processes, bypasses the GIL)
+IO_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="datawiz-io")
+
+
+def _make_cpu_pool() -> ProcessPoolExecutor:
+    # Never fork() a process that already runs DuckDB, Arrow and thread pools.
+    # forkserver is POSIX-only; elsewhere (Windows) the default is spawn.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(
+        max_workers=max(2, (os.cpu_count() or 1) - 1),
+        mp_context=multiprocessing.get_context(method),
+    )
+
+
+CPU_POOL = _make_cpu_pool()
+
+
+async def _run_in(executor: Executor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call on the bounded IO thread pool."""
+    return await _run_in(IO_POOL, func, *args, **kwargs)
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a picklable CPU-bound call on the process pool.
+
+    If a worker dies (e.g. killed for running out of memory) the pool is
+    broken for good; replace it so later calls still work, and re-raise.
+    """
+    global CPU_POOL
+    pool = CPU_POOL
+    try:
+        return await _run_in(pool, func, *args, **kwargs)
+    except BrokenProcessPool:
+        if CPU_POOL is pool:
+            CPU_POOL = _make_cpu_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def shutdown_executors() -> None:
+    IO_POOL.shutdown(wait=False, cancel_futures=True)
+    CPU_POOL.shutdown(wait=False, cancel_futures=True)
@@ -53,10 +53,14 @@ function attachPreviewToggle() {
   previewDiv.prepend(btn);
 }
 
+// Preview is columnar: preview.data[i] holds the values of preview.columns[i]
 function renderTablePreview(preview) {
-  if (!preview || !preview.columns || !preview.rows) return '';
+  if (!preview || !preview.columns || !preview.data) return '';
   const header = `<tr>${preview.columns.map(c => `<th>${c}</th>`).join('')}</tr>`;
-  const rows = preview.rows.map(r => `<tr>${preview.columns.map(c => `<td>${r[c] ?? ''}</td>`).join('')}</tr>`).join('');
+  const rowCount = preview.data.length ? preview.data[0].length : 0;
+  const rows = Array.from({ length: rowCount }, (_, i) =>
+    `<tr>${preview.data.map(col => `<td>${col[i] ?? ''}</td>`).join('')}</tr>`
+  ).join('');
   return `<div class="preview-body"><table>${header}${rows}</table></div>`;
 }
 